@@ -1,17 +1,23 @@
 from time import sleep
 
-from clients import gemini_client
+from clients import get_gemini, get_perplexity
 from search_papers import EnhancedPaperSearch
-from src.clients import perplexity_client
 
 from summarize_papers import PaperSummarizer
 
+try:
+    import uvloop
+    loop_factory = uvloop.new_event_loop
+except ImportError:
+    # uvloop is unavailable on Windows, fall back to the default asyncio loop
+    loop_factory = None
+
 
 if '__main__' == __name__:
-    search_engine = EnhancedPaperSearch(perplexity_client)
+    search_engine = EnhancedPaperSearch(get_perplexity())
     papers = search_engine.search_papers(topic='Large Language Models', pub_from="2025-10-21", pub_to="2025-10-28", max_results=1)
     sleep(3)
     level = "newbie"
     language = "it"
-    summarizer = PaperSummarizer(gemini_client)
-    summaries = summarizer.summarize_papers(papers=papers, level=level, language=language, parallel=True)
\ No newline at end of file
+    with PaperSummarizer(get_gemini(), loop_factory=loop_factory) as summarizer:
+        summaries = summarizer.summarize_papers(papers=papers, level=level, language=language, parallel=True)
\ No newline at end of file
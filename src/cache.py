@@ -0,0 +1,40 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import orjson
+
+
+class SqliteCache:
+    """JSON values stored by (kind, key) in a single SQLite database"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+
+    def get(self, key: str, kind: str) -> Optional[Any]:
+        """Return the cached value for (kind, key), or None on a miss"""
+        row = self._connection.execute(
+            "SELECT value FROM cache WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def put(self, key: str, kind: str, value: Any) -> None:
+        """Store a JSON-serializable value under (kind, key)"""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO cache (kind, key, value, created_at) VALUES (?, ?, ?, ?)",
+            (kind, key, orjson.dumps(value), time.time())
+        )
+
+    def close(self) -> None:
+        self._connection.close()
@@ -1,9 +1,22 @@
+from functools import cache
+
 from dotenv import load_dotenv
-from perplexity import Perplexity
-from openai import OpenAI
-from google import genai
 load_dotenv()
 
-openai_client = OpenAI()
-gemini_client = genai.Client()
-perplexity_client = Perplexity()
\ No newline at end of file
+
+# SDK clients are built on first use, so scripts only pay for the ones they need
+
+@cache
+def get_openai():
+    from openai import OpenAI
+    return OpenAI()
+
+@cache
+def get_gemini():
+    from google import genai
+    return genai.Client()
+
+@cache
+def get_perplexity():
+    from perplexity import Perplexity
+    return Perplexity()
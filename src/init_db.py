@@ -1,6 +1,9 @@
 from src.chroma_collections.papers import PaperCollection, Paper
 from pdf_loader import load_papers
 
+# Papers sent per PaperCollection.add call, so each embedding request carries a full batch
+ADD_BATCH_SIZE = 64
+
 def load_db(delete_collection = False):
     if delete_collection:
         PaperCollection.delete_collection()
@@ -8,13 +11,15 @@ def load_db(delete_collection = False):
 
     pdfs = load_papers()
 
-    for pdf in pdfs:
-        paper_collection.add([
-            Paper(
-                text=pdf.extracted_text,
-                id=pdf.paper_name
-            ),
-        ])
+    papers = [
+        Paper(
+            text=pdf.extracted_text,
+            id=pdf.paper_name
+        )
+        for pdf in pdfs
+    ]
+    for i in range(0, len(papers), ADD_BATCH_SIZE):
+        paper_collection.add(papers[i:i + ADD_BATCH_SIZE])
 if '__main__' == __name__:
 
     load_db()
@@ -1,3 +1,4 @@
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 
 from pydantic import BaseModel
@@ -14,31 +15,32 @@ class PdfLoader(BaseModel):
 
 def load_paper(paper) -> str:
     pdf_reader = PdfReader(PAPER_DIR.joinpath(paper))
-    text = ""
+    parts: List[str] = []
     for page in pdf_reader.pages:
         extracted_text = page.extract_text()
         if extracted_text:
-            text += extracted_text
-    return text
+            parts.append(extracted_text)
+    return "".join(parts)
 
 def load_papers() -> List[PdfLoader]:
     papers = os.listdir(PAPER_DIR)
+    # Text extraction is CPU-bound pure Python, so spread it across processes
+    max_workers = min(os.cpu_count() or 1, 4)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        texts = list(executor.map(load_paper, papers))
     pdfs: List[PdfLoader] = []
-    for paper in papers:
-        pdf = PdfLoader(paper_name=paper, extracted_text=load_paper(paper))
+    for paper, text in zip(papers, texts):
+        pdf = PdfLoader(paper_name=paper, extracted_text=text)
         pdfs.append(pdf)
     return pdfs
 
 def split_text(txt: str, chunk_size=500, overlap=50) -> List[str]:
-    chunks: List[str] = []
-    start: int = 0
-    end: int = 0
-
-    while end < len(txt):
-        end = start + chunk_size
-        if end > len(txt):
-            end = len(txt)
-        chunks.append(txt[start:end])
-        start = end - overlap
-
-    return chunks
\ No newline at end of file
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+    if not txt:
+        return []
+
+    # The last window starts before len(txt) - overlap, so the tail is always covered
+    starts = range(0, max(len(txt) - overlap, 1), step)
+    return [txt[start:start + chunk_size] for start in starts]
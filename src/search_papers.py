@@ -1,21 +1,26 @@
-import json
-import re
+import orjson
 import time
 import logging
-from time import sleep
 from typing import List, Optional
 from datetime import datetime
+import numpy as np
 from pydantic import BaseModel, Field
-from utils import search_prompt_template
+from pydantic.json_schema import SkipJsonSchema
+from utils import search_system_prompt, render_search_prompt, is_arxiv_url, normalize_arxiv_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on already-seen URLs repeated in the search prompt
+MAX_PROMPT_SEEN_URLS = 20
+
 class SearchedPaper(BaseModel):
     url: str = Field(description="The URL of the paper. It must be the link to the pdf, not to the abstract")
     title: str = Field(description="The title of the paper")
     publication_date: str = Field(description="The publication date of the paper")
     citation_number: int = Field(description="The citation number of the paper")
+    # Computed locally after the search, so it is kept out of the schema sent to the LLM
+    composite_score: SkipJsonSchema[float] = 0.0
 
 class PapersList(BaseModel):
     papers: list[SearchedPaper]
@@ -24,61 +29,44 @@ class EnhancedPaperSearch:
     def __init__(self, perplexity_client):
         self.client = perplexity_client
 
-    def _build_search_prompt(self, topic: str, pub_from: str, pub_to: str, seen_urls: list[str]) -> str:
-        """Build the search prompt with dynamic parameters"""
-        period_range = f"{pub_from} to {pub_to}"
-
-        return search_prompt_template.format(
+    def _build_search_prompt(self, topic: str, pub_from: str, pub_to: str, max_results: int, seen_urls: list[str]) -> str:
+        """Build the user prompt carrying the dynamic search parameters"""
+        return render_search_prompt(
             topic=topic,
             pub_from=pub_from,
             pub_to=pub_to,
+            max_results=max_results,
             url_list=",".join(seen_urls),
         )
 
-    def _calculate_composite_score(self, paper: dict) -> float:
-        """Calculate a composite score based on multiple factors"""
-        score = 0.0
+    def _calculate_composite_scores(self, papers: List[SearchedPaper]) -> np.ndarray:
+        """Calculate composite scores for all papers at once, based on multiple factors"""
+        def metric(name: str) -> np.ndarray:
+            return np.array([getattr(paper, name, 0) or 0 for paper in papers], dtype=np.float64)
 
         # Citation impact (40%)
-        citations = paper.get('citations', 0) or 0
-        citation_score = min(citations / 100, 1.0)  # Normalize to 0-1
-        score += citation_score * 0.4
+        citation_score = np.minimum(metric('citation_number') / 100, 1.0)  # Normalize to 0-1
 
         # Social proof (30%)
-        social_mentions = paper.get('social_mentions', 0) or 0
-        github_stars = paper.get('github_stars', 0) or 0
-        social_score = min((social_mentions + github_stars / 100) / 50, 1.0)
-        score += social_score * 0.3
+        social_score = np.minimum((metric('social_mentions') + metric('github_stars') / 100) / 50, 1.0)
 
         # Authority (20%)
-        author_hindex = paper.get('author_hindex', 0) or 0
-        authority_score = min(author_hindex / 50, 1.0)
-        score += authority_score * 0.2
-
-        # Recency (10%)
-        pub_date = paper.get('publication_date', '')
-        if pub_date:
+        authority_score = np.minimum(metric('author_hindex') / 50, 1.0)
+
+        # Recency (10%), papers without a parseable year get a default score
+        current_year = datetime.now().year
+        recency_score = np.zeros(len(papers), dtype=np.float64)
+        for i, paper in enumerate(papers):
+            if not paper.publication_date:
+                continue
             try:
-                pub_year = int(pub_date[:4])
-                current_year = datetime.now().year
-                recency_score = max(0, 1 - (current_year - pub_year) / 10)
-                score += recency_score * 0.1
-            except:
-                score += 0.05  # Default recency score
-
-        return round(score, 3)
-
-    def _enhance_paper_data(self, paper: SearchedPaper) -> SearchedPaper:
-        """Enhance paper data with additional metrics"""
-        # Add composite score
-        paper_dict = paper.model_dump()
-        paper_dict['composite_score'] = self._calculate_composite_score(paper_dict)
-
-        # Ensure PDF URL
-        if hasattr(paper, 'url') and 'abs' in paper.url:
-            paper.url = paper.url.replace('abs', 'pdf')
+                pub_year = int(paper.publication_date[:4])
+                recency_score[i] = max(0, 1 - (current_year - pub_year) / 10)
+            except ValueError:
+                recency_score[i] = 0.5
 
-        return SearchedPaper.model_validate(paper_dict)
+        score = 0.4 * citation_score + 0.3 * social_score + 0.2 * authority_score + 0.1 * recency_score
+        return np.round(score, 3)
 
     def _validate_and_convert_arxiv_url(self, url: str) -> str:
         """
@@ -89,31 +77,16 @@ class EnhancedPaperSearch:
             raise ValueError("Empty URL provided")
 
         # Check if it's an arXiv URL
-        if 'arxiv.org' not in url:
+        if not is_arxiv_url(url):
             raise ValueError(f"Non-arXiv domain: {url}")
 
-        # Extract arXiv ID with more flexible patterns
-        arxiv_patterns = [
-            r'arxiv\.org/(?:abs|pdf)/(\d+\.\d+(?:v\d+)?)',
-            r'arxiv\.org/(?:abs|pdf)/([a-z-]+/\d+\.\d+(?:v\d+)?)',
-            r'/(\d+\.\d+(?:v\d+)?)(?:\.pdf)?$',
-            r'/([a-z-]+/\d+\.\d+(?:v\d+)?)(?:\.pdf)?$'
-        ]
-
-        arxiv_id = None
-        for pattern in arxiv_patterns:
-            match = re.search(pattern, url)
-            if match:
-                arxiv_id = match.group(1)
-                break
-
-        if not arxiv_id:
-            raise ValueError(f"Could not extract arXiv ID from: {url}")
-
-        # Construct PROPER arXiv PDF URL (without .pdf extension)
+        # Rewrite abs/pdf/.pdf variants to the PROPER arXiv PDF URL (without .pdf extension)
         # arXiv prefers: https://arxiv.org/pdf/2507.13334v2
         # Not: https://arxiv.org/pdf/2507.13334v2.pdf
-        proper_pdf_url = f"https://arxiv.org/pdf/{arxiv_id}"
+        proper_pdf_url = normalize_arxiv_url(url)
+
+        if not proper_pdf_url:
+            raise ValueError(f"Could not extract arXiv ID from: {url}")
 
         return proper_pdf_url
 
@@ -137,13 +110,16 @@ class EnhancedPaperSearch:
         """
         final_papers: List[SearchedPaper] = []
         exhausted_cycles = 5
-        seen_urls = set()
+        seen_urls: set[str] = set()
         while len(final_papers) < max_results and exhausted_cycles>0:
             if domains is None:
                 domains = ["arxiv.org", "scholar.google.com", "semanticscholar.org"]
 
             try:
-                search_prompt = self._build_search_prompt(topic, pub_from, pub_to, list(seen_urls))
+                # Deduplication happens against seen_urls below, the prompt only carries
+                # the most recent URLs as a hint so its size stays bounded
+                recent_urls = [paper.url for paper in final_papers[-MAX_PROMPT_SEEN_URLS:]]
+                search_prompt = self._build_search_prompt(topic, pub_from, pub_to, max_results, recent_urls)
 
                 logger.info(f"Searching for papers on '{topic}' from {pub_from} to {pub_to}")
 
@@ -152,11 +128,11 @@ class EnhancedPaperSearch:
                     messages=[
                         {
                             "role": "system",
-                            "content": search_prompt
+                            "content": search_system_prompt
                         },
                         {
                             "role": "user",
-                            "content": f"Topic: **{topic}**. Publication Period: **{pub_from} to {pub_to}**. Return maximum {max_results} papers ranked by impact. You MUST search ONLY pdf papers, not abstract not html pages. Only pdf papers"
+                            "content": search_prompt
                         }
                     ],
                     search_domain_filter=domains,
@@ -180,7 +156,7 @@ class EnhancedPaperSearch:
                     raise ValueError("Empty response content")
 
                 # Parse and validate response
-                response_dict = json.loads(raw_response)
+                response_dict = orjson.loads(raw_response)
 
                 if 'papers' not in response_dict:
                     raise ValueError("Invalid response format: missing 'papers' key")
@@ -195,14 +171,17 @@ class EnhancedPaperSearch:
 
                         paper = SearchedPaper.model_validate(paper_data)
                         validated_papers.append(paper)
-                        sleep(0.5)
 
                     except ValueError as e:
                         logger.warning(f"Excluding invalid paper URL: {e}")
                         continue
 
                 # Sort by composite score (descending)
-                validated_papers.sort(key=lambda x: x.composite_score if hasattr(x, 'composite_score') else 0, reverse=True)
+                scores = self._calculate_composite_scores(validated_papers)
+                for paper, score in zip(validated_papers, scores):
+                    paper.composite_score = float(score)
+                order = np.argsort(-scores, kind='stable')
+                validated_papers = [validated_papers[i] for i in order]
 
                 # Limit results
 
@@ -213,7 +192,7 @@ class EnhancedPaperSearch:
 
                 logger.info(f"Successfully retrieved {len(final_papers)} papers")
                 exhausted_cycles -= 1
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.error(f"JSON parsing error: {e}")
                 raise ValueError(f"Failed to parse search response: {e}")
             except Exception as e:
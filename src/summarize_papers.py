@@ -1,23 +1,54 @@
 import asyncio
+import os
 import re
 
 import httpx
-import json
+import orjson
 import time
 import hashlib
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from pathlib import Path
 import logging
 from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor
 from google.genai import types
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
-from utils import summarize_prompt_template, summarize_newsletter_prompt_template
+from cache import SqliteCache
+from utils import render_summarize_prompt, render_summarize_batch_prompt, extract_arxiv_id, is_arxiv_url, truncate_html_summary
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Gemini rejects requests with more than 20MB of inline data, so larger PDFs are not worth downloading
+MAX_PDF_BYTES = 20 * 1024 * 1024
+PDF_CONTENT_TYPES = ('application/pdf', 'application/octet-stream')
+
+# Papers summarized per Gemini request, small enough to keep every summary within the output token budget
+SUMMARY_BATCH_SIZE = 8
+
+# Raw PDF bytes per batch request. Inline PDFs travel base64-encoded (4/3 larger) in the same
+# 20MB request as the prompt, so a batch must stay well below MAX_PDF_BYTES to be accepted
+BATCH_PROMPT_RESERVE_BYTES = 256 * 1024
+MAX_BATCH_PDF_BYTES = MAX_PDF_BYTES * 3 // 4 - BATCH_PROMPT_RESERVE_BYTES
+
+INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+WHITESPACE = re.compile(r'\s+')
+
+# arXiv IDs carrying an explicit version (e.g. 2401.12345v2) never change content
+ARXIV_VERSIONED_ID = re.compile(r'v\d+$')
+
+
+class PdfFetchError(Exception):
+    """Raised when a downloaded document is not a usable PDF"""
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write data to path so readers never observe a partially written file"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
 
 @dataclass
 class SummaryResult:
@@ -30,19 +61,67 @@ class SummaryResult:
     metadata: Optional[Dict] = None
 
 
+@dataclass
+class PendingSummary:
+    """A downloaded paper still waiting for its Gemini summary"""
+    paper: object
+    doc_data: bytes
+    summary_cache_path: Path
+    arxiv_key: Optional[str]
+    start_time: float
+
+
+class BatchSummaryEntry(BaseModel):
+    """One paper's summary in a batched Gemini response"""
+    id: str
+    html: str
+
+
+BATCH_RESPONSE = TypeAdapter(list[BatchSummaryEntry])
+
+
 class PaperSummarizer:
-    def __init__(self, gemini_client, output_dir: str = "./summaries", max_workers: int = 3):
+    def __init__(
+            self,
+            gemini_client,
+            output_dir: str = "./summaries",
+            max_workers: int = 3,
+            batch_size: int = SUMMARY_BATCH_SIZE,
+            loop_factory: Optional[Callable[[], asyncio.AbstractEventLoop]] = None
+    ):
         self.client = gemini_client
         self.max_workers = max_workers
+        self.batch_size = batch_size
         self.output_dir = Path(output_dir)
         self.timeout = httpx.Timeout(30.0, connect=10.0)
         self.output_dir.mkdir(exist_ok=True)
+        self.pdf_cache_dir = self.output_dir / "pdf_cache"
+        self.pdf_cache_dir.mkdir(exist_ok=True)
+        self.summary_cache_dir = self.output_dir / "gemini_cache"
+        self.summary_cache_dir.mkdir(exist_ok=True)
+        self.summary_db = SqliteCache(self.output_dir / "summary_cache.sqlite3")
+        # One event loop and one connection pool for the summarizer's lifetime,
+        # so keep-alive connections are reused across summarize_papers calls
+        self._runner = asyncio.Runner(loop_factory=loop_factory)
+        self._http = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(max_connections=10))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """Close the shared HTTP client, its event loop and the summary database"""
+        self._runner.run(self._http.aclose())
+        self._runner.close()
+        self.summary_db.close()
 
     def _sanitize_filename(self, filename: str) -> str:
         """Sanitize filename to be filesystem-safe"""
         # Remove invalid characters and replace spaces with underscores
-        sanitized = re.sub(r'[<>:"/\\|?*]', '', filename)
-        sanitized = re.sub(r'\s+', '_', sanitized)
+        sanitized = INVALID_FILENAME_CHARS.sub('', filename)
+        sanitized = WHITESPACE.sub('_', sanitized)
         # Limit length to avoid filesystem issues
         if len(sanitized) > 150:
             sanitized = sanitized[:150]
@@ -76,11 +155,19 @@ class PaperSummarizer:
 
     def _build_enhanced_prompt(self, level: str, language: str) -> str:
         """Build the enhanced summarization prompt"""
-        return summarize_prompt_template.format(level=level, language=language)
+        return render_summarize_prompt(level, language)
 
-    def _build_enhanced_prompt_newsletter(self, summary: str) -> str:
-        """Build the enhanced summarization prompt"""
-        return summarize_newsletter_prompt_template.format(summary=summary)
+    def _build_batch_prompt(self, batch: List[PendingSummary], level: str, language: str) -> str:
+        """Build the prompt summarizing several attached papers in one request"""
+        papers_json = orjson.dumps([
+            {"id": str(i), "title": getattr(item.paper, 'title', 'Unknown')}
+            for i, item in enumerate(batch, start=1)
+        ]).decode('utf-8')
+        return render_summarize_batch_prompt(len(batch), papers_json, level, language)
+
+    def _build_newsletter_excerpt(self, summary: str) -> str:
+        """Build the short HTML excerpt of a summary shown in the newsletter"""
+        return truncate_html_summary(summary)
 
     def _validate_html_response(self, text: str) -> Dict:
         """Validate and parse the model response"""
@@ -94,85 +181,334 @@ class PaperSummarizer:
 
         try:
             # Try to parse as JSON first (in case model misformats)
-            json_data = json.loads(cleaned_text)
+            json_data = orjson.loads(cleaned_text)
             return {
                 "html_summary": json_data.get('summary', cleaned_text),
                 "metadata": json_data
             }
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # It's HTML as expected
             return {
                 "html_summary": cleaned_text,
                 "metadata": {"format": "html"}
             }
 
-    def _summarize_single_paper(self, paper, level: str, language: str) -> SummaryResult:
-        """Summarize a single paper with comprehensive error handling"""
+    def _pdf_cache_paths(self, url: str) -> tuple[Path, Path, bool]:
+        """Return the cached PDF path, its validators path and whether the cached copy is immutable"""
+        # Only arXiv itself guarantees that an ID names one PDF, mirrors are keyed by their URL
+        arxiv_id = extract_arxiv_id(url) if is_arxiv_url(url) else None
+        if arxiv_id:
+            cache_key = self._sanitize_filename(arxiv_id)
+            immutable = bool(ARXIV_VERSIONED_ID.search(arxiv_id))
+        else:
+            cache_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+            immutable = False
+
+        pdf_path = self.pdf_cache_dir / f"{cache_key}.pdf"
+        validators_path = self.pdf_cache_dir / f"{cache_key}.json"
+        return pdf_path, validators_path, immutable
+
+    def _arxiv_summary_key(self, url: str, level: str, language: str) -> Optional[str]:
+        """Return the cross-run cache key of a summary, only for immutable (versioned) arXiv papers"""
+        arxiv_id = extract_arxiv_id(url) if is_arxiv_url(url) else None
+        if not arxiv_id or not ARXIV_VERSIONED_ID.search(arxiv_id):
+            return None
+        return f"{arxiv_id}:{level}:{language}"
+
+    def _summary_cache_path(self, doc_data: bytes, level: str, language: str) -> Path:
+        """Return the cache path of the summary generated for this PDF, level and language"""
+        pdf_hash = hashlib.sha256(doc_data).hexdigest()
+        key = f"{pdf_hash}-{self._sanitize_filename(level)}-{self._sanitize_filename(language)}"
+        return self.summary_cache_dir / f"{key}.html"
+
+    async def _fetch_pdf(self, url: str, client: httpx.AsyncClient) -> bytes:
+        """Download the PDF behind a paper URL, reusing the on-disk cache when possible"""
+        pdf_path, validators_path, immutable = self._pdf_cache_paths(url)
+
+        headers = {}
+        if pdf_path.exists():
+            if immutable:
+                logger.info(f"PDF cache hit: {url}")
+                return pdf_path.read_bytes()
+
+            # Revalidate the cached copy with a conditional GET
+            if validators_path.exists():
+                validators = orjson.loads(validators_path.read_bytes())
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and pdf_path.exists():
+                logger.info(f"PDF not modified, using cached copy: {url}")
+                return pdf_path.read_bytes()
+            response.raise_for_status()
+
+            # Bail out before buffering anything that is not a PDF or is too large
+            content_type = response.headers.get('content-type', '')
+            if not content_type.startswith(PDF_CONTENT_TYPES):
+                raise PdfFetchError(f"Unexpected content type '{content_type}' for {url}")
+            content_length = int(response.headers.get('content-length') or 0)
+            if content_length > MAX_PDF_BYTES:
+                raise PdfFetchError(f"PDF too large ({content_length} bytes) for {url}")
+
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes(1 << 16):
+                buffer.extend(chunk)
+                if len(buffer) > MAX_PDF_BYTES:
+                    raise PdfFetchError(f"PDF exceeds {MAX_PDF_BYTES} bytes for {url}")
+
+        doc_data = bytes(buffer)
+        _atomic_write_bytes(pdf_path, doc_data)
+        validators = {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+        }
+        _atomic_write_bytes(validators_path, orjson.dumps(validators))
+        return doc_data
+
+    def _success_result(self, paper, validation_result: Dict, level: str, language: str, start_time: float) -> SummaryResult:
+        """Save a generated or cached summary and wrap it in a SummaryResult"""
+        html_summary = validation_result["html_summary"]
+
+        # Save HTML summary to file
+        self._save_html_summary(html_summary, getattr(paper, 'title', 'Unknown_Title'), language, level)
+
+        return SummaryResult(
+            paper_url=paper.url,
+            title=getattr(paper, 'title', 'Unknown'),
+            html_summary=html_summary,
+            status="success",
+            processing_time=time.time() - start_time,
+            metadata=validation_result["metadata"]
+        )
+
+    def _error_result(self, paper, status: str, error: str, start_time: float) -> SummaryResult:
+        """Wrap a failure in a SummaryResult"""
+        return SummaryResult(
+            paper_url=paper.url,
+            title=getattr(paper, 'title', 'Unknown'),
+            html_summary="",
+            status=status,
+            processing_time=time.time() - start_time,
+            error=error
+        )
+
+    async def _prepare_paper(
+            self,
+            paper,
+            level: str,
+            language: str,
+            client: httpx.AsyncClient,
+            sem: asyncio.Semaphore
+    ) -> SummaryResult | PendingSummary:
+        """Resolve a paper from the caches, or download its PDF so it can be summarized"""
         start_time = time.time()
-        paper_title = getattr(paper, 'title', 'Unknown_Title')
 
         try:
-            # Fetch PDF content
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.get(paper.url)
-                response.raise_for_status()
-                doc_data = response.content
-
-            # Generate summary
-            prompt = self._build_enhanced_prompt(level, language)
-
-            api_response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[
-                    types.Part.from_bytes(
-                        data=doc_data,
-                        mime_type='application/pdf',
-                    ),
-                    prompt
-                ],
-                config=types.GenerateContentConfig(
-                    temperature=0.2,  # Lower temp for more consistent results
-                    top_p=0.8,
-                )
-            )
-
-            # Validate and process response
-            validation_result = self._validate_html_response(api_response.text)
-
-            html_summary = validation_result["html_summary"]
-
-            # Save HTML summary to file
-            saved_path = self._save_html_summary(html_summary, paper_title, language, level)
+            # Versioned arXiv papers are summarized once per level and language, across runs
+            arxiv_key = self._arxiv_summary_key(paper.url, level, language)
+            cached_summary = self.summary_db.get(arxiv_key, "summary") if arxiv_key else None
+            if cached_summary is not None:
+                logger.info(f"arXiv summary cache hit: {paper.url}")
+                validation_result = {
+                    "html_summary": cached_summary,
+                    "metadata": {"format": "html", "cached": True}
+                }
+                return self._success_result(paper, validation_result, level, language, start_time)
 
-            return SummaryResult(
-                paper_url=paper.url,
-                title=getattr(paper, 'title', 'Unknown'),
-                html_summary=validation_result["html_summary"],
-                status="success",
-                processing_time=time.time() - start_time,
-                metadata=validation_result["metadata"]
-            )
+            # Fetch PDF content
+            async with sem:
+                doc_data = await self._fetch_pdf(paper.url, client)
+
+            summary_cache_path = self._summary_cache_path(doc_data, level, language)
+            if summary_cache_path.exists():
+                logger.info(f"Summary cache hit: {paper.url}")
+                validation_result = {
+                    "html_summary": summary_cache_path.read_text(encoding='utf-8'),
+                    "metadata": {"format": "html", "cached": True}
+                }
+                if arxiv_key:
+                    self.summary_db.put(arxiv_key, "summary", validation_result["html_summary"])
+                return self._success_result(paper, validation_result, level, language, start_time)
+
+            return PendingSummary(paper, doc_data, summary_cache_path, arxiv_key, start_time)
 
         except httpx.HTTPError as e:
             logger.error(f"HTTP error for {paper.url}: {e}")
-            return SummaryResult(
-                paper_url=paper.url,
-                title=getattr(paper, 'title', 'Unknown'),
-                html_summary="",
-                status="fetch_error",
-                processing_time=time.time() - start_time,
-                error=f"HTTP error: {str(e)}"
-            )
+            return self._error_result(paper, "fetch_error", f"HTTP error: {str(e)}", start_time)
+        except PdfFetchError as e:
+            logger.error(f"Rejected PDF for {paper.url}: {e}")
+            return self._error_result(paper, "fetch_error", f"Fetch error: {str(e)}", start_time)
         except Exception as e:
             logger.error(f"Summarization failed for {paper.url}: {e}")
-            return SummaryResult(
-                paper_url=paper.url,
-                title=getattr(paper, 'title', 'Unknown'),
-                html_summary="",
-                status="error",
-                processing_time=time.time() - start_time,
-                error=f"Processing error: {str(e)}"
+            return self._error_result(paper, "error", f"Processing error: {str(e)}", start_time)
+
+    async def _generate_summaries(self, batch: List[PendingSummary], level: str, language: str) -> List[Optional[str]]:
+        """Summarize a batch of PDFs in one Gemini request, returning the raw texts in batch order
+
+        A paper missing from a batch response, or every paper of an unparseable one, gets None.
+        """
+        contents = [
+            types.Part.from_bytes(
+                data=item.doc_data,
+                mime_type='application/pdf',
+            )
+            for item in batch
+        ]
+
+        if len(batch) == 1:
+            contents.append(self._build_enhanced_prompt(level, language))
+            config = types.GenerateContentConfig(
+                temperature=0.2,  # Lower temp for more consistent results
+                top_p=0.8,
             )
+        else:
+            contents.append(self._build_batch_prompt(batch, level, language))
+            config = types.GenerateContentConfig(
+                temperature=0.2,
+                top_p=0.8,
+                response_mime_type='application/json',
+                response_schema=list[BatchSummaryEntry],
+            )
+
+        # The Gemini SDK call is blocking, keep it off the event loop
+        api_response = await asyncio.to_thread(
+            self.client.models.generate_content,
+            model="gemini-2.5-flash",
+            contents=contents,
+            config=config
+        )
+
+        if len(batch) == 1:
+            return [api_response.text]
+        try:
+            entries = BATCH_RESPONSE.validate_json(api_response.text)
+        except ValidationError as e:
+            logger.warning(f"Malformed batch response, summarizing its {len(batch)} papers one by one: {e.errors()[0]['msg']}")
+            return [None] * len(batch)
+        summaries = {entry.id: entry.html for entry in entries}
+        return [summaries.get(str(i)) for i in range(1, len(batch) + 1)]
+
+    async def _summarize_batch(
+            self,
+            batch: List[PendingSummary],
+            level: str,
+            language: str,
+            sem: asyncio.Semaphore
+    ) -> List[SummaryResult]:
+        """Summarize a batch of downloaded papers with comprehensive error handling"""
+        try:
+            async with sem:
+                texts = await self._generate_summaries(batch, level, language)
+        except Exception as e:
+            if len(batch) > 1:
+                # A failed batch request says nothing about its papers, retry each one on its own
+                logger.warning(f"Batch request failed, summarizing its {len(batch)} papers one by one: {e}")
+                texts = [None] * len(batch)
+            else:
+                logger.error(f"Summarization failed for {batch[0].paper.url}: {e}")
+                return [self._error_result(batch[0].paper, "error", f"Processing error: {str(e)}", batch[0].start_time)]
+
+        results = []
+        for item, text in zip(batch, texts):
+            if text is None:
+                # Not usable from the batch response, fall back to a single-paper request
+                results.extend(await self._summarize_batch([item], level, language, sem))
+                continue
+            try:
+                # Validate and process response
+                validation_result = self._validate_html_response(text)
+                _atomic_write_bytes(item.summary_cache_path, validation_result["html_summary"].encode('utf-8'))
+                if item.arxiv_key:
+                    self.summary_db.put(item.arxiv_key, "summary", validation_result["html_summary"])
+                results.append(self._success_result(item.paper, validation_result, level, language, item.start_time))
+            except Exception as e:
+                logger.error(f"Summarization failed for {item.paper.url}: {e}")
+                results.append(self._error_result(item.paper, "error", f"Processing error: {str(e)}", item.start_time))
+        return results
+
+    def _log_result(self, result: SummaryResult) -> None:
+        """Log the outcome of a single paper summarization"""
+        if "success" in result.status:
+            logger.info(f"✓ Summarized: {result.title} ({result.processing_time:.1f}s)")
+        else:
+            logger.warning(f"✗ Failed: {result.title} - {result.error}")
+
+    async def _summarize_all(
+            self,
+            papers: List,
+            level: str,
+            language: str,
+            parallel: bool
+    ) -> List[SummaryResult]:
+        """Run the fetch + summarize pipeline over all papers on the shared HTTP client"""
+        client = self._http
+        if parallel and len(papers) > 1:
+            # Concurrent downloads and Gemini requests, each bounded by max_workers
+            download_sem = asyncio.Semaphore(self.max_workers)
+            summary_sem = asyncio.Semaphore(self.max_workers)
+            # Downloaded PDFs stay in memory until their batch is summarized. Cap them at one
+            # full batch plus the downloads in progress, so a batch can always fill up
+            held_pdfs = asyncio.Semaphore(self.batch_size + self.max_workers)
+            results: List[Optional[SummaryResult]] = [None] * len(papers)
+            prepared: asyncio.Queue = asyncio.Queue()
+
+            async def prepare(index: int, paper) -> None:
+                await held_pdfs.acquire()
+                outcome = await self._prepare_paper(paper, level, language, client, download_sem)
+                if isinstance(outcome, SummaryResult):
+                    held_pdfs.release()
+                prepared.put_nowait((index, outcome))
+
+            async def summarize(batch: List[Tuple[int, PendingSummary]]) -> None:
+                batch_results = await self._summarize_batch([item for _, item in batch], level, language, summary_sem)
+                for (index, _), result in zip(batch, batch_results):
+                    results[index] = result
+                    self._log_result(result)
+                    held_pdfs.release()
+                # Drop the only references to the batch's PDF bytes as soon as it is summarized
+                batch.clear()
+
+            async with asyncio.TaskGroup() as tg:
+                for index, paper in enumerate(papers):
+                    tg.create_task(prepare(index, paper))
+
+                # Send a batch to Gemini as soon as it is full, while the remaining PDFs are still downloading
+                batch: List[Tuple[int, PendingSummary]] = []
+                batch_bytes = 0
+                for _ in papers:
+                    index, outcome = await prepared.get()
+                    if isinstance(outcome, SummaryResult):
+                        # Cache hits and failed downloads are reported as soon as they finish
+                        results[index] = outcome
+                        self._log_result(outcome)
+                        continue
+                    if batch and batch_bytes + len(outcome.doc_data) > MAX_BATCH_PDF_BYTES:
+                        tg.create_task(summarize(batch))
+                        batch, batch_bytes = [], 0
+                    batch.append((index, outcome))
+                    batch_bytes += len(outcome.doc_data)
+                    if len(batch) >= self.batch_size:
+                        tg.create_task(summarize(batch))
+                        batch, batch_bytes = [], 0
+                if batch:
+                    tg.create_task(summarize(batch))
+            return results
+
+        # Sequential processing
+        sem = asyncio.Semaphore(1)
+        results = []
+        for paper in papers:
+            result = await self._prepare_paper(paper, level, language, client, sem)
+            if isinstance(result, PendingSummary):
+                [result] = await self._summarize_batch([result], level, language, sem)
+            self._log_result(result)
+            results.append(result)
+            # Small delay to avoid rate limiting
+            await asyncio.sleep(0.5)
+        return results
 
     def summarize_papers(
             self,
@@ -192,22 +528,7 @@ class PaperSummarizer:
         """
         logger.info(f"Starting summarization of {len(papers)} papers for {level} audience")
 
-        if parallel and len(papers) > 1:
-            # Parallel processing for multiple papers
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = [
-                    executor.submit(self._summarize_single_paper, paper, level, language)
-                    for paper in papers
-                ]
-                results = [future.result() for future in futures]
-        else:
-            # Sequential processing
-            results = []
-            for paper in papers:
-                result = self._summarize_single_paper(paper, level, language)
-                results.append(result)
-                # Small delay to avoid rate limiting
-                time.sleep(0.5)
+        results = self._runner.run(self._summarize_all(papers, level, language, parallel))
 
         # Convert to dictionary format for compatibility
         summary_dicts = []
@@ -234,9 +555,6 @@ class PaperSummarizer:
 
             if "success" in result.status:
                 success_count += 1
-                logger.info(f"✓ Summarized: {result.title} ({result.processing_time:.1f}s)")
-            else:
-                logger.warning(f"✗ Failed: {result.title} - {result.error}")
 
         logger.info(f"Summarization complete: {success_count}/{len(papers)} successful")
         return summary_dicts
\ No newline at end of file
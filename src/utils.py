@@ -1,88 +1,56 @@
-search_prompt_template = """
-# CRITICAL: ARXIV-ONLY ACADEMIC PAPER DISCOVERY
-
-**MANDATORY DOMAIN CONSTRAINTS:**
-- **PRIMARY SOURCE:** arxiv.org (95% of results MUST come from here)
-- **SECONDARY SOURCES:** Only for citation validation: Google Scholar, Semantic Scholar
-- **STRICTLY EXCLUDED:** Dictionary sites, blogs, news articles, commercial websites, non-academic domains
-
-**URL VALIDATION PROTOCOL - CRITICAL:**
-1. **ALL FINAL URLs MUST BE ARXIV PDFs:** `https://arxiv.org/pdf/XXXX.XXXXX` (with no .pdf extension)
-2. **CONVERT ABSTRACT LINKS:** Automatically change `/abs/` to `/pdf/`
-3. **REJECT NON-PDF URLs:** Immediately discard any result without PDF download
-4. **VERIFY DOMAIN:** Only `arxiv.org` domains accepted for final papers
-
-## SEARCH MISSION
-Find the **most influential arXiv research papers** for:
-- **Topic:** {topic}
-- **Publication Window:** {pub_from} to {pub_to}
-
-## INTELLIGENT RANKING ALGORITHM
-Papers must be ranked using this **multi-factor scoring system**:
-
-### 1. CITATION IMPACT (40% weight)
-- Total citation count (primary) - **from external sources only**
-- Citation velocity (recent citations/year)
-- Citation sources diversity
-
-### 2. COMMUNITY ENGAGEMENT (30% weight)
-- Social media mentions (X/Twitter, Reddit)
-- GitHub stars/forks (for computational papers)
-- Blog posts and media coverage
-- Conference presentation mentions
-
-### 3. AUTHORITY METRICS (20% weight)
-- Author h-index and reputation
-- Publishing venue prestige
-- Institutional affiliation impact
-
-### 4. RECENCY & RELEVANCE (10% weight)
-- Temporal relevance to query
-- Methodological novelty
-- Direct topic alignment
-
-## STRICT DATA VERIFICATION PROTOCOL
-
-### PHASE 1: SOURCE VALIDATION
-- **CONFIRM ARXIV ORIGIN:** Every paper must have arXiv ID
-- **VALIDATE PUBLICATION DATE:** Must be within {pub_from} to {pub_to}
-- **VERIFY PDF ACCESS:** Direct PDF download must be available
-
-### PHASE 2: CONTENT VALIDATION
-- **REJECT NON-RESEARCH:** Exclude tutorials, surveys, non-peer-reviewed content
-- **CONFIRM TOPIC ALIGNMENT:** Must be directly related to {topic}
-- **CHECK FOR RETRACTIONS:** Verify paper status
-- URLS MUST be different from {url_list}
-
-### PHASE 3: URL SANITIZATION
-- **ENSURE PDF FORMAT:** All final URLs must point to PDF files
-- **FIX ARXIV LINKS:** Convert `https://arxiv.org/abs/XXXX.XXXXX` to `https://arxiv.org/pdf/XXXX.XXXXX` (without .pdf extension)
-- **VALIDATE ACCESSIBILITY:** Confirm URLs return PDF content (not HTML)
-
-## OUTPUT REQUIREMENTS
-
-### MANDATORY FIELDS:
-- **arxiv_id:** arXiv identifier (e.g., "2401.12345")
-- **title:** Paper title
-- **authors:** Author list
-- **publication_date:** Publication date in YYYY-MM-DD format
-- **url:** **DIRECT ARXIV PDF LINK** (format: `https://arxiv.org/pdf/XXXX.XXXXX.pdf`)
-- **citation_count:** Number of citations
-- **composite_score:** Calculated ranking score
-
-### STRICT URL ENFORCEMENT:
-```json
-"url": "https://arxiv.org/pdf/2401.12345v1"  // CORRECT
-"url": "https://arxiv.org/abs/2401.12345"       // REJECT - convert to PDF
-"url": "https://example.com/paper.pdf"          // REJECT - non-arXiv domain
-"""
-
-summarize_prompt_template = """
-You are an expert science communicator creating engaging newsletter content. Analyze this research paper and create a compelling summary.
+import re
+import sys
+from html import escape
+from html.parser import HTMLParser
+from typing import Dict, Final, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+def _normalize_prompt(template: str) -> str:
+    """Drop trailing spaces and runs of blank lines so they are not sent as tokens on every call"""
+    template = re.sub(r'[ \t]+\n', '\n', template)
+    template = re.sub(r'\n{3,}', '\n\n', template)
+    return sys.intern(template.strip())
+
+
+search_system_prompt: Final[str] = _normalize_prompt("""
+# ARXIV-ONLY ACADEMIC PAPER DISCOVERY
+
+Find the most influential arXiv research papers for the topic and publication window given by the user.
+
+**DOMAINS:** Final papers come from arxiv.org only. Google Scholar and Semantic Scholar may be used solely to validate citations. Exclude dictionaries, blogs, news and commercial sites.
+
+**URL FORMAT:** Every `url` is an arXiv PDF link without .pdf extension, e.g. `https://arxiv.org/pdf/2401.12345v1`.
 
+## RANKING
+1. **Citation impact (40%):** external citation count, citation velocity, source diversity
+2. **Community engagement (30%):** X/Twitter and Reddit mentions, GitHub stars/forks, blog and media coverage, conference talks
+3. **Authority (20%):** author h-index, venue prestige, institutional impact
+4. **Recency & relevance (10%):** temporal relevance, methodological novelty, topic alignment
+
+## VERIFICATION
+- **PHASE 1 - SOURCE:** the paper has an arXiv ID, a publication date within the window and a downloadable PDF
+- **PHASE 2 - CONTENT:** original research only (no tutorials, surveys or non-peer-reviewed content), directly on topic, not retracted, and not among the recently seen URLs listed by the user
+
+## OUTPUT
+For each paper return `url`, `title`, `publication_date` (YYYY-MM-DD) and `citation_number`.
+""")
+
+search_user_prompt_template: Final[str] = _normalize_prompt("""
+Topic: **{topic}**
+Publication Window: **{pub_from} to {pub_to}**
+Return maximum {max_results} papers ranked by impact.
+""")
+
+# Appended to the search prompt only once there are seen URLs to exclude
+search_seen_urls_template: Final[str] = _normalize_prompt("""
+Recently seen URLs (do not return again): {url_list}
+""")
+
+# Style guidance shared by the single-paper and batch prompts; each prompt adds its own output format
+summarize_guidance_template: Final[str] = _normalize_prompt("""
 **AUDIENCE:** {level} level
 **LANGUAGE:** {language}
-**FORMAT:** Single HTML string
 **READING TIME:** ≤ 3 minutes
 
 **CONTENT STRATEGY:**
@@ -133,17 +101,191 @@ You are an expert science communicator creating engaging newsletter content. Ana
 - Maintain consistent tone: authoritative yet accessible
 - Ensure smooth transitions between sections
 - Focus on narrative flow over exhaustive detail
+""")
+
+summarize_prompt_template: Final[str] = _normalize_prompt(f"""
+You are an expert science communicator creating engaging newsletter content. Analyze this research paper and create a compelling summary.
+
+**FORMAT:** Single HTML string
+
+{summarize_guidance_template}
 
 **CRITICAL: Output ONLY the HTML string, no additional text.**
-"""
+""")
+
+summarize_batch_prompt_template: Final[str] = _normalize_prompt(f"""
+You are an expert science communicator creating engaging newsletter content. You are receiving {{count}} research papers as PDF attachments, in the same order as this list:
+{{papers_json}}
+
+Create a compelling summary of EACH paper on its own.
+
+**FORMAT:** One HTML string per paper, following the structure below
+
+{summarize_guidance_template}
+
+**CRITICAL: Output ONLY a JSON array with one object per paper: [{{"id": "<id from the list above>", "html": "<HTML summary>"}}]**
+""")
+
+
+PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+
+def _split_template(template: str) -> Tuple[List[str], List[str]]:
+    """Split a template once into its literal chunks and the placeholder names between them"""
+    pieces = PLACEHOLDER_RE.split(template)
+    return pieces[0::2], pieces[1::2]
+
+
+def _render(split_template: Tuple[List[str], List[str]], values: Dict[str, object]) -> str:
+    """Interleave the literal chunks of a pre-split template with the placeholder values"""
+    literals, names = split_template
+    parts = [literals[0]]
+    for name, literal in zip(names, literals[1:]):
+        parts.append(str(values[name]))
+        parts.append(literal)
+    return "".join(parts)
+
+
+_search_user_prompt_parts = _split_template(search_user_prompt_template)
+_search_seen_urls_parts = _split_template(search_seen_urls_template)
+_summarize_prompt_parts = _split_template(summarize_prompt_template)
+_summarize_batch_prompt_parts = _split_template(summarize_batch_prompt_template)
+
+
+def render_search_prompt(topic: str, pub_from: str, pub_to: str, max_results: int, url_list: str) -> str:
+    """Render search_user_prompt_template without re-parsing it on every call"""
+    prompt = _render(_search_user_prompt_parts, {
+        "topic": topic,
+        "pub_from": pub_from,
+        "pub_to": pub_to,
+        "max_results": max_results,
+    })
+    if not url_list:
+        return prompt
+    return prompt + "\n" + _render(_search_seen_urls_parts, {"url_list": url_list})
+
+
+def render_summarize_prompt(level: str, language: str) -> str:
+    """Render summarize_prompt_template without re-parsing it on every call"""
+    return _render(_summarize_prompt_parts, {"level": level, "language": language})
+
+
+def render_summarize_batch_prompt(count: int, papers_json: str, level: str, language: str) -> str:
+    """Render summarize_batch_prompt_template without re-parsing it on every call"""
+    return _render(_summarize_batch_prompt_parts, {
+        "count": count,
+        "papers_json": papers_json,
+        "level": level,
+        "language": language,
+    })
+
+
+# Union of the accepted arXiv URL shapes: an /abs/ or /pdf/ path on arxiv.org,
+# or a trailing (optionally .pdf-suffixed) ID at the end of the URL
+ARXIV_ID_RE = re.compile(
+    r'arxiv\.org/(?:abs|pdf)/((?:[a-z-]+/)?\d+\.\d+(?:v\d+)?)'
+    r'|/(\d+\.\d+(?:v\d+)?)(?:\.pdf)?$'
+)
+
+
+def extract_arxiv_id(url: str) -> Optional[str]:
+    """Extract the arXiv ID (e.g. 2401.12345v2) from an arXiv URL, if any"""
+    match = ARXIV_ID_RE.search(url)
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+
+# Elements that never have a closing tag
+VOID_ELEMENTS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+})
+
+
+class _HtmlTruncator(HTMLParser):
+    """Copy HTML until `limit` visible characters have been emitted, tracking open tags"""
+
+    def __init__(self, limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.length = 0
+        self.truncated = False
+        self.parts: List[str] = []
+        self.open_tags: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.truncated:
+            return
+        self.parts.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.truncated:
+            self.parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.truncated or tag not in self.open_tags:
+            return
+        # Close anything left open inside this element, then the element itself
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.truncated:
+            return
+        if data.isspace():
+            # Indentation between tags is not visible text
+            self.parts.append(data)
+            return
+        remaining = self.limit - self.length
+        if len(data) <= remaining:
+            self.parts.append(escape(data, quote=False))
+            self.length += len(data)
+            return
+        self.parts.append(escape(data[:remaining], quote=False) + "…")
+        self.length = self.limit
+        self.truncated = True
+
+
+def truncate_html_summary(paper_summary: str, limit: int = 500) -> str:
+    """
+    Shorten an HTML summary to its first `limit` visible characters followed by "…",
+    closing any tags left open so the excerpt is still valid HTML.
+    Summaries already within the limit are returned unchanged.
+    """
+    truncator = _HtmlTruncator(limit)
+    truncator.feed(paper_summary)
+    truncator.close()
+    if not truncator.truncated:
+        return paper_summary
+
+    closing_tags = "".join(f"</{tag}>" for tag in reversed(truncator.open_tags))
+    return "".join(truncator.parts) + closing_tags
+
+
+ARXIV_HOSTS: Final = frozenset({"arxiv.org", "www.arxiv.org", "export.arxiv.org"})
+
 
-summarize_newsletter_prompt_template = """
-Your sole role is to reduce the received HTML code which represents a summary of a scientific article in order to show only first 500 characters.
-After that you must display 3 dots.
+def is_arxiv_url(url: str) -> bool:
+    """Check that the URL is served by arXiv itself, not merely mentioning arxiv.org"""
+    try:
+        return urlsplit(url).hostname in ARXIV_HOSTS
+    except ValueError:
+        return False
 
-YOu MUST not alter the content of the first 500 characters but you must return a valid html file
 
---- COMPLETE PAPER SUMMARY START ---
-{paper_summary}
---- COMPLETE PAPER SUMMARY END ---
-"""
+def normalize_arxiv_url(url: str) -> Optional[str]:
+    """Return the canonical arXiv PDF URL (without .pdf extension) for an arXiv URL, or None"""
+    if not url or not is_arxiv_url(url):
+        return None
+    # Only the host and path identify the paper, ignore any query string or fragment
+    parts = urlsplit(url)
+    arxiv_id = extract_arxiv_id(f"{parts.hostname}{parts.path}")
+    if not arxiv_id:
+        return None
+    return f"https://arxiv.org/pdf/{arxiv_id}"